@@ -1,36 +1,105 @@
+import calendar
+import hashlib
+import mimetypes
 import os
 import re
 import sqlite3
-from datetime import datetime, date
+import tempfile
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
 from pathlib import Path
+from urllib.parse import quote
 
 from flask import (
     Flask,
+    abort,
     flash,
+    g,
+    get_flashed_messages,
+    make_response,
     redirect,
     render_template,
     request,
     send_from_directory,
     url_for,
 )
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
+# Tesseract's OpenMP threading costs more than it saves on receipts. Keep each
+# OCR call on one core and scale across cores with worker processes instead
+# (e.g. gunicorn -w N app:app).
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 APP_ROOT = Path(__file__).resolve().parent
 DB_PATH = APP_ROOT / "expense_tracker.db"
 UPLOAD_DIR = APP_ROOT / "uploads"
+# Internal nginx location aliased to UPLOAD_DIR; when set, uploads are served
+# by nginx through X-Accel-Redirect instead of being streamed by Flask.
+UPLOADS_ACCEL_REDIRECT = os.environ.get("UPLOADS_ACCEL_REDIRECT")
 
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
+_ALLOWED_SUFFIXES = tuple(f".{extension}" for extension in sorted(ALLOWED_EXTENSIONS))
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+OCR_MAX_SIDE = 1600
+OCR_THRESHOLD = 160
+SUMMARY_CACHE_SIZE = 64
+ENTRIES_PAGE_SIZE = 50
+# A pending receipt older than this lost its OCR job (worker killed, reloader
+# restart), since jobs only live in process memory.
+OCR_STALE_AFTER = timedelta(minutes=30)
+DAYS_IN_MONTH = (31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+_OCR_RE = re.compile(
+    r"(?P<kw>(?:total|amount due|balance)\s*[:$]?\s*(?P<kwamt>[0-9,]+\.\d{2}))"
+    r"|(?P<amt>(?<!\d)[0-9]{1,3}(?:,[0-9]{3})*\.\d{2})"
+    r"|(?P<date>\d{4}[-/]\d{2}[-/]\d{2}|\d{2}/\d{2}/\d{4})",
+    re.IGNORECASE,
+)
+_COMMA_TRANS = str.maketrans("", "", ",")
 
 app = Flask(__name__)
 app.secret_key = "dev-secret-key"
+# Behind Apache with mod_xsendfile, let it send files via X-Sendfile.
+app.use_x_sendfile = os.environ.get("USE_X_SENDFILE") == "1"
+
+_OCR_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+_summary_cache = {}
 
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = g.get("_db")
+    if conn is None:
+        conn = g._db = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=134217728")
     return conn
 
 
+@app.teardown_appcontext
+def close_db(exc):
+    conn = g.pop("_db", None)
+    if conn is not None:
+        conn.close()
+
+
+def upgrade_db(conn):
+    # Column additions the code cannot run without. Cheap and idempotent, so it
+    # also runs on every start against an existing database.
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(receipts)")}
+    if "ocr_status" not in columns:
+        # Receipts from before background OCR were all processed at upload
+        # time, so the default marks them done.
+        conn.execute(
+            "ALTER TABLE receipts ADD COLUMN ocr_status TEXT NOT NULL DEFAULT 'done'"
+        )
+
+
 def init_db():
     with get_db() as conn:
         conn.execute(
@@ -51,162 +120,463 @@ def init_db():
             CREATE TABLE IF NOT EXISTS receipts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 filename TEXT NOT NULL,
-                ocr_text TEXT,
+                ocr_text BLOB,
                 detected_amount REAL,
                 detected_date TEXT,
                 entry_id INTEGER,
                 created_at TEXT NOT NULL,
+                ocr_status TEXT NOT NULL DEFAULT 'done',
                 FOREIGN KEY(entry_id) REFERENCES entries(id)
             )
             """
         )
+        upgrade_db(conn)
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_entries_date_type
+            ON entries(entry_date, entry_type, amount)
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_entries_recent
+            ON entries(entry_date DESC, created_at DESC, id DESC)
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_entries_cat
+            ON entries(entry_type, entry_date, category)
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_receipts_created
+            ON receipts(created_at DESC)
+            """
+        )
+        conn.execute("ANALYZE")
 
 
 def allowed_file(filename):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(_ALLOWED_SUFFIXES)
+
+
+def prepare_ocr_image(image):
+    from PIL import Image, ImageOps
+
+    image = image.convert("L")
+    if max(image.size) > OCR_MAX_SIDE:
+        image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.LANCZOS)
+    image = ImageOps.autocontrast(image)
+    return image.point(lambda p: 255 if p > OCR_THRESHOLD else 0, mode="1")
 
 
-def try_ocr_image(image_path):
+def try_ocr_images(image_paths):
+    texts = [None] * len(image_paths)
     try:
         import pytesseract
         from PIL import Image
     except ImportError:
-        return None, "OCR libraries not installed."
+        return texts, "OCR libraries not installed."
 
+    errors = []
     try:
-        text = pytesseract.image_to_string(Image.open(image_path))
-        return text, None
+        with tempfile.TemporaryDirectory() as work_dir:
+            # Prepare each image on its own so one unreadable upload only
+            # loses its own slot, not the whole batch.
+            prepared = []
+            sources = []
+            for index, image_path in enumerate(image_paths):
+                source = Path(work_dir) / f"{index}.png"
+                try:
+                    prepare_ocr_image(Image.open(image_path)).save(source)
+                except Exception as exc:
+                    errors.append(f"OCR failed for {Path(image_path).name}: {exc}")
+                    continue
+                prepared.append(index)
+                sources.append(str(source))
+
+            if sources:
+                if len(sources) == 1:
+                    source = sources[0]
+                else:
+                    # Tesseract treats a .txt list of image paths as one
+                    # multi-page input, so a batch costs a single process start.
+                    source = Path(work_dir) / "images.txt"
+                    source.write_text("\n".join(sources))
+                    source = str(source)
+
+                # Pages come back separated by form feeds.
+                pages = pytesseract.image_to_string(source, config=TESSERACT_CONFIG).split("\f")
+                pages += [""] * (len(sources) - len(pages))
+                for index, page in zip(prepared, pages):
+                    texts[index] = page
     except Exception as exc:
-        return None, f"OCR failed: {exc}"
+        errors.append(f"OCR failed: {exc}")
+    return texts, "; ".join(errors) or None
 
 
-def extract_amount(text):
+def process_ocr(text):
     if not text:
-        return None
+        return None, None
+    # Every amount needs a decimal point and every date a "-" or "/"; skip the
+    # regex scan entirely for OCR output that has none of them.
+    if "." not in text and "/" not in text and "-" not in text:
+        return None, None
+
+    keyword_amount = None
+    max_amount = None
+    detected_date = None
+    for match in _OCR_RE.finditer(text):
+        if match.group("kwamt"):
+            if keyword_amount is None:
+                keyword_amount = float(match.group("kwamt").translate(_COMMA_TRANS))
+        elif match.group("amt"):
+            # The running max only matters until a keyword amount turns up.
+            if keyword_amount is None:
+                value = float(match.group("amt").translate(_COMMA_TRANS))
+                if max_amount is None or value > max_amount:
+                    max_amount = value
+        elif detected_date is None:
+            detected_date = parse_date_string(match.group("date"))
+
+    amount = keyword_amount if keyword_amount is not None else max_amount
+    return amount, detected_date
+
+
+def is_valid_date(year, month, day):
+    if year < 1 or not 1 <= month <= 12 or not 1 <= day <= DAYS_IN_MONTH[month - 1]:
+        return False
+    return month != 2 or day != 29 or calendar.isleap(year)
 
-    keyword_match = re.search(
-        r"(?i)(total|amount due|balance)\s*[:$]?\s*([0-9,]+\.\d{2})",
-        text,
-    )
-    if keyword_match:
-        return float(keyword_match.group(2).replace(",", ""))
 
-    amounts = re.findall(r"(?<!\d)([0-9]{1,3}(?:,[0-9]{3})*(?:\.\d{2}))", text)
-    if not amounts:
+def parse_date_string(raw_date):
+    if not raw_date or len(raw_date) != 10:
         return None
 
-    values = [float(value.replace(",", "")) for value in amounts]
-    return max(values) if values else None
-
-
-def parse_date_string(raw_date):
-    if not raw_date:
+    # The separator positions identify the layout, so no format guessing is
+    # needed: YYYY-MM-DD / YYYY/MM/DD, else MM/DD/YYYY with DD/MM/YYYY fallback.
+    if raw_date[4] == raw_date[7] and raw_date[4] in "-/":
+        year, month, day = raw_date[:4], raw_date[5:7], raw_date[8:]
+        candidates = ((year, month, day),)
+    elif raw_date[2] == raw_date[5] == "/":
+        first, second, year = raw_date[:2], raw_date[3:5], raw_date[6:]
+        candidates = ((year, first, second), (year, second, first))
+    else:
         return None
 
-    formats = ["%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%d/%m/%Y"]
-    for fmt in formats:
-        try:
-            parsed = datetime.strptime(raw_date, fmt)
-            return parsed.date().isoformat()
-        except ValueError:
-            continue
+    for year, month, day in candidates:
+        digits = year + month + day
+        if digits.isascii() and digits.isdigit() and is_valid_date(
+            int(year), int(month), int(day)
+        ):
+            return f"{year}-{month}-{day}"
     return None
 
 
-def extract_date(text):
-    if not text:
-        return None
+def year_bounds(year):
+    start = f"{int(year):04d}-01-01"
+    end = f"{int(year) + 1:04d}-01-01"
+    return start, end
 
-    patterns = [
-        r"(\d{4}-\d{2}-\d{2})",
-        r"(\d{4}/\d{2}/\d{2})",
-        r"(\d{2}/\d{2}/\d{4})",
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            parsed = parse_date_string(match.group(1))
-            if parsed:
-                return parsed
-    return None
 
+def get_now_iso():
+    # One timestamp per request (or OCR job), so rows written together share
+    # the same created_at.
+    now = g.get("_now")
+    if now is None:
+        now = g._now = datetime.utcnow().isoformat()
+    return now
 
-def insert_entry(entry_type, amount, category, note, entry_date):
-    created_at = datetime.utcnow().isoformat()
-    with get_db() as conn:
-        cursor = conn.execute(
+
+# The bulk helpers run on the caller's connection and leave the transaction to
+# the caller (`with conn:`), so a whole batch commits, and fsyncs, once. Inserts
+# go row by row because executemany() does not report the new ids.
+def insert_entries_bulk(conn, rows):
+    created_at = get_now_iso()
+    return [
+        conn.execute(
             """
             INSERT INTO entries (entry_type, amount, category, note, entry_date, created_at)
             VALUES (?, ?, ?, ?, ?, ?)
             """,
-            (entry_type, amount, category, note, entry_date, created_at),
-        )
-        return cursor.lastrowid
+            (*row, created_at),
+        ).lastrowid
+        for row in rows
+    ]
 
 
-def insert_receipt(filename, ocr_text, detected_amount, detected_date, entry_id):
-    created_at = datetime.utcnow().isoformat()
-    with get_db() as conn:
+def insert_receipts_bulk(conn, rows):
+    created_at = get_now_iso()
+    return [
         conn.execute(
             """
-            INSERT INTO receipts (filename, ocr_text, detected_amount, detected_date, entry_id, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO receipts (
+                filename, ocr_text, detected_amount, detected_date, entry_id, ocr_status, created_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
-            (filename, ocr_text, detected_amount, detected_date, entry_id, created_at),
+            (*row, created_at),
+        ).lastrowid
+        for row in rows
+    ]
+
+
+def update_receipts_bulk(conn, rows):
+    conn.executemany(
+        """
+        UPDATE receipts
+        SET ocr_text = ?, detected_amount = ?, detected_date = ?, entry_id = ?,
+            ocr_status = 'done'
+        WHERE id = ?
+        """,
+        rows,
+    )
+
+
+def insert_entry(entry_type, amount, category, note, entry_date):
+    with get_db() as conn:
+        return insert_entries_bulk(conn, [(entry_type, amount, category, note, entry_date)])[0]
+
+
+def compress_ocr_text(text):
+    # OCR text is kept for reference only; level 1 shrinks it several times
+    # for almost no CPU.
+    return zlib.compress(text.encode("utf-8"), 1)
+
+
+def ocr_receipts(receipt_ids, image_paths):
+    ocr_texts, ocr_error = try_ocr_images(image_paths)
+    if ocr_error:
+        app.logger.warning(ocr_error)
+
+    results = []
+    entry_rows = []
+    for receipt_id, ocr_text in zip(receipt_ids, ocr_texts):
+        detected_amount, detected_date = process_ocr(ocr_text)
+        detected_date = detected_date or date.today().isoformat()
+        results.append((receipt_id, ocr_text, detected_amount, detected_date))
+        if detected_amount is not None:
+            entry_rows.append(
+                (
+                    "expense",
+                    detected_amount,
+                    "Receipt",
+                    "Auto-imported from receipt",
+                    detected_date,
+                )
+            )
+
+    # New entries and the receipt links commit together, so a failure cannot
+    # leave auto-imported expenses without their receipt.
+    with get_db() as conn:
+        entry_ids = iter(insert_entries_bulk(conn, entry_rows))
+        update_receipts_bulk(
+            conn,
+            [
+                (
+                    compress_ocr_text(ocr_text) if ocr_text else None,
+                    detected_amount,
+                    detected_date,
+                    next(entry_ids) if detected_amount is not None else None,
+                    receipt_id,
+                )
+                for receipt_id, ocr_text, detected_amount, detected_date in results
+            ],
+        )
+
+
+def process_receipts(receipt_ids, image_paths):
+    # Runs on _OCR_POOL, whose futures nobody waits on: log every failure here
+    # and make sure the receipts leave the pending state.
+    with app.app_context():
+        try:
+            ocr_receipts(receipt_ids, image_paths)
+        except Exception:
+            app.logger.exception("OCR failed for receipts %s", receipt_ids)
+            try:
+                mark_receipts_failed(receipt_ids)
+            except Exception:
+                app.logger.exception("Could not mark receipts %s as failed", receipt_ids)
+
+
+def mark_receipts_failed(receipt_ids):
+    with get_db() as conn:
+        conn.executemany(
+            "UPDATE receipts SET ocr_status = 'failed' WHERE id = ? AND ocr_status = 'pending'",
+            [(receipt_id,) for receipt_id in receipt_ids],
         )
 
 
+def ocr_stale_cutoff():
+    return (datetime.utcnow() - OCR_STALE_AFTER).isoformat()
+
+
+def fail_stale_receipts(conn):
+    conn.execute(
+        "UPDATE receipts SET ocr_status = 'failed' WHERE ocr_status = 'pending' AND created_at < ?",
+        (ocr_stale_cutoff(),),
+    )
+
+
+def fetch_year_totals(conn, start, end):
+    # Plain tuples are enough here; skip the sqlite3.Row wrapper.
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    total_income, total_expense = cursor.execute(
+        """
+        SELECT
+            SUM(CASE WHEN entry_type = 'income' THEN amount ELSE 0 END),
+            SUM(CASE WHEN entry_type = 'expense' THEN amount ELSE 0 END)
+        FROM entries
+        WHERE entry_date >= ? AND entry_date < ?
+        """,
+        (start, end),
+    ).fetchone()
+    return total_income or 0, total_expense or 0
+
+
+def entries_version(conn):
+    # Entries are only ever inserted, so the newest id identifies the data.
+    return conn.execute("SELECT MAX(id) FROM entries").fetchone()[0]
+
+
+def cached_summary(key, version, compute):
+    cached = _summary_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    if len(_summary_cache) >= SUMMARY_CACHE_SIZE:
+        _summary_cache.clear()
+    payload = compute()
+    _summary_cache[key] = (version, payload)
+    return payload
+
+
+def markup_version():
+    # Fingerprint of the code and templates, so a deploy that changes the page
+    # markup also changes every ETag.
+    digest = hashlib.md5()
+    for path in [Path(__file__), *sorted((APP_ROOT / "templates").glob("*.html"))]:
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def summary_etag(key, version):
+    return hashlib.md5(f"{_MARKUP_VERSION}:{key}:{version}".encode("utf-8")).hexdigest()
+
+
+_MARKUP_VERSION = markup_version()
+
+
+def not_modified(etag):
+    response = make_response("", 304)
+    response.set_etag(etag)
+    return response
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    init_db()
+
+
 UPLOAD_DIR.mkdir(exist_ok=True)
-init_db()
+# Indexes and the full schema are applied by `flask init-db` (or `python
+# app.py`); importing the app only creates a missing database, or adds the
+# columns an existing one needs.
+with app.app_context():
+    if DB_PATH.exists():
+        with get_db() as conn:
+            upgrade_db(conn)
+            fail_stale_receipts(conn)
+    else:
+        init_db()
 
 
 @app.route("/")
 def index():
     current_year = str(date.today().year)
-    with get_db() as conn:
-        totals = conn.execute(
-            """
-            SELECT
-                SUM(CASE WHEN entry_type = 'income' THEN amount ELSE 0 END) AS total_income,
-                SUM(CASE WHEN entry_type = 'expense' THEN amount ELSE 0 END) AS total_expense
-            FROM entries
-            WHERE strftime('%Y', entry_date) = ?
-            """,
-            (current_year,),
-        ).fetchone()
+    start, end = year_bounds(current_year)
+    conn = get_db()
+    key = ("index", current_year)
+    version = entries_version(conn)
+    etag = summary_etag(key, version)
+    # Pages carrying flash messages must not be served from a client cache.
+    flashes = get_flashed_messages()
+    if not flashes and etag in request.if_none_match:
+        return not_modified(etag)
+
+    def compute():
+        totals = fetch_year_totals(conn, start, end)
 
         recent_entries = conn.execute(
             """
             SELECT * FROM entries
-            ORDER BY entry_date DESC, created_at DESC
+            ORDER BY entry_date DESC, created_at DESC, id DESC
             LIMIT 6
             """
         ).fetchall()
+        return totals, recent_entries
+
+    totals, recent_entries = cached_summary(key, version, compute)
 
-    total_income = totals["total_income"] or 0
-    total_expense = totals["total_expense"] or 0
+    total_income, total_expense = totals
     net = total_income - total_expense
 
-    return render_template(
-        "index.html",
-        current_year=current_year,
-        total_income=total_income,
-        total_expense=total_expense,
-        net=net,
-        recent_entries=recent_entries,
+    response = make_response(
+        render_template(
+            "index.html",
+            current_year=current_year,
+            total_income=total_income,
+            total_expense=total_expense,
+            net=net,
+            recent_entries=recent_entries,
+        )
     )
+    if not flashes:
+        response.set_etag(etag)
+    return response
 
 
 @app.route("/entries")
 def entries():
+    # Keyset pagination: each page starts after the last entry of the previous
+    # one, so deep pages are an index seek rather than an OFFSET scan.
+    before = request.args.get("before", type=int)
     with get_db() as conn:
-        rows = conn.execute(
-            """
-            SELECT * FROM entries
-            ORDER BY entry_date DESC, created_at DESC
-            """
-        ).fetchall()
-    return render_template("entries.html", entries=rows)
+        if before is None:
+            rows = conn.execute(
+                """
+                SELECT * FROM entries
+                ORDER BY entry_date DESC, created_at DESC, id DESC
+                LIMIT ?
+                """,
+                (ENTRIES_PAGE_SIZE + 1,),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                """
+                SELECT * FROM entries
+                WHERE (entry_date, created_at, id) < (
+                    SELECT entry_date, created_at, id FROM entries WHERE id = ?
+                )
+                ORDER BY entry_date DESC, created_at DESC, id DESC
+                LIMIT ?
+                """,
+                (before, ENTRIES_PAGE_SIZE + 1),
+            ).fetchall()
+
+    # A cursor that matches nothing (unknown id, or a hand-edited URL) would
+    # otherwise render as an empty table; start over from the first page.
+    if before is not None and not rows:
+        return redirect(url_for("entries"))
+
+    next_before = None
+    if len(rows) > ENTRIES_PAGE_SIZE:
+        rows = rows[:ENTRIES_PAGE_SIZE]
+        next_before = rows[-1]["id"]
+    return render_template("entries.html", entries=rows, next_before=next_before)
 
 
 @app.route("/entries/new", methods=["GET", "POST"])
@@ -240,11 +610,20 @@ def receipts():
     with get_db() as conn:
         rows = conn.execute(
             """
-            SELECT r.*, e.entry_date, e.amount AS entry_amount
+            SELECT
+                r.id,
+                r.filename,
+                r.detected_amount,
+                r.detected_date,
+                r.created_at,
+                r.ocr_status = 'pending' AND r.created_at >= ? AS processing,
+                e.entry_date,
+                e.amount AS entry_amount
             FROM receipts r
             LEFT JOIN entries e ON r.entry_id = e.id
             ORDER BY r.created_at DESC
-            """
+            """,
+            (ocr_stale_cutoff(),),
         ).fetchall()
     return render_template("receipts.html", receipts=rows)
 
@@ -252,40 +631,40 @@ def receipts():
 @app.route("/receipts/upload", methods=["GET", "POST"])
 def upload_receipt():
     if request.method == "POST":
-        file = request.files.get("receipt")
-        if not file or file.filename == "":
+        files = [f for f in request.files.getlist("receipt") if f.filename]
+        if not files:
             flash("Please select a receipt image.", "error")
             return redirect(url_for("upload_receipt"))
 
-        if not allowed_file(file.filename):
+        if not all(allowed_file(f.filename) for f in files):
             flash("Upload a PNG or JPG image.", "error")
             return redirect(url_for("upload_receipt"))
 
-        filename = secure_filename(file.filename)
-        filepath = UPLOAD_DIR / filename
-        file.save(filepath)
+        filenames = []
+        for file in files:
+            # A random prefix keeps same-named uploads (within a batch or
+            # across requests) from overwriting each other.
+            filename = f"{uuid.uuid4().hex[:12]}_{secure_filename(file.filename)}"
+            file.save(UPLOAD_DIR / filename)
+            filenames.append(filename)
+
+        with get_db() as conn:
+            receipt_ids = insert_receipts_bulk(
+                conn,
+                [(filename, None, None, None, None, "pending") for filename in filenames],
+            )
+        image_paths = [UPLOAD_DIR / filename for filename in filenames]
 
-        ocr_text, ocr_error = try_ocr_image(filepath)
-        detected_amount = extract_amount(ocr_text)
-        detected_date = extract_date(ocr_text) or date.today().isoformat()
+        _OCR_POOL.submit(process_receipts, receipt_ids, image_paths)
 
-        entry_id = None
-        if detected_amount is not None:
-            entry_id = insert_entry(
-                "expense",
-                detected_amount,
-                "Receipt",
-                "Auto-imported from receipt",
-                detected_date,
+        if len(receipt_ids) > 1:
+            flash(
+                f"{len(receipt_ids)} receipts saved. Amounts are being detected.",
+                "success",
             )
-            flash("Receipt processed and expense saved.", "success")
         else:
-            flash("Receipt saved, but amount was not detected.", "warning")
+            flash("Receipt saved. Amount is being detected.", "success")
 
-        if ocr_error:
-            flash(ocr_error, "warning")
-
-        insert_receipt(filename, ocr_text, detected_amount, detected_date, entry_id)
         return redirect(url_for("receipts"))
 
     return render_template("upload_receipt.html")
@@ -293,64 +672,85 @@ def upload_receipt():
 
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename):
+    if UPLOADS_ACCEL_REDIRECT:
+        if safe_join(str(UPLOAD_DIR), filename) is None:
+            abort(404)
+        response = make_response("")
+        response.headers["X-Accel-Redirect"] = (
+            f"{UPLOADS_ACCEL_REDIRECT.rstrip('/')}/{quote(filename)}"
+        )
+        response.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        return response
     return send_from_directory(UPLOAD_DIR, filename)
 
 
 @app.route("/yearly-summary")
 def yearly_summary():
     year = request.args.get("year") or str(date.today().year)
-    with get_db() as conn:
-        totals = conn.execute(
-            """
-            SELECT
-                SUM(CASE WHEN entry_type = 'income' THEN amount ELSE 0 END) AS total_income,
-                SUM(CASE WHEN entry_type = 'expense' THEN amount ELSE 0 END) AS total_expense
-            FROM entries
-            WHERE strftime('%Y', entry_date) = ?
-            """,
-            (year,),
-        ).fetchone()
+    try:
+        start, end = year_bounds(year)
+    except ValueError:
+        year = str(date.today().year)
+        start, end = year_bounds(year)
+    conn = get_db()
+    key = ("yearly_summary", year)
+    version = entries_version(conn)
+    etag = summary_etag(key, version)
+    flashes = get_flashed_messages()
+    if not flashes and etag in request.if_none_match:
+        return not_modified(etag)
+
+    def compute():
+        totals = fetch_year_totals(conn, start, end)
 
         monthly_rows = conn.execute(
             """
             SELECT
-                strftime('%m', entry_date) AS month,
+                substr(entry_date, 6, 2) AS month,
                 SUM(CASE WHEN entry_type = 'income' THEN amount ELSE 0 END) AS income,
                 SUM(CASE WHEN entry_type = 'expense' THEN amount ELSE 0 END) AS expense
             FROM entries
-            WHERE strftime('%Y', entry_date) = ?
-            GROUP BY strftime('%m', entry_date)
+            WHERE entry_date >= ? AND entry_date < ?
+            GROUP BY substr(entry_date, 6, 2)
             ORDER BY month
             """,
-            (year,),
+            (start, end),
         ).fetchall()
 
         category_rows = conn.execute(
             """
             SELECT category, SUM(amount) AS total
             FROM entries
-            WHERE entry_type = 'expense' AND strftime('%Y', entry_date) = ?
+            WHERE entry_type = 'expense' AND entry_date >= ? AND entry_date < ?
             GROUP BY category
             ORDER BY total DESC
             """,
-            (year,),
+            (start, end),
         ).fetchall()
+        return totals, monthly_rows, category_rows
 
-    total_income = totals["total_income"] or 0
-    total_expense = totals["total_expense"] or 0
+    totals, monthly_rows, category_rows = cached_summary(key, version, compute)
+
+    total_income, total_expense = totals
     net = total_income - total_expense
 
-    return render_template(
-        "yearly_summary.html",
-        year=year,
-        total_income=total_income,
-        total_expense=total_expense,
-        net=net,
-        monthly_rows=monthly_rows,
-        category_rows=category_rows,
+    response = make_response(
+        render_template(
+            "yearly_summary.html",
+            year=year,
+            total_income=total_income,
+            total_expense=total_expense,
+            net=net,
+            monthly_rows=monthly_rows,
+            category_rows=category_rows,
+        )
     )
+    if not flashes:
+        response.set_etag(etag)
+    return response
 
 
 if __name__ == "__main__":
-    init_db()
+    with app.app_context():
+        init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)